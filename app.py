@@ -1,188 +1,494 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file, url_for
+import io
+import mmap
+import multiprocessing
 import os
+import re
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from werkzeug.utils import secure_filename
 import json
-from collections import defaultdict
-from typing import Dict, List, Tuple, Set
+import numpy as np
+from itertools import compress
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Tuple, Union
+from numba import njit, prange, set_num_threads
+
+# Bytes that str.split() treats as whitespace, including the \x1c-\x1f separators
+IS_WHITESPACE = np.isin(np.arange(256), np.frombuffer(b'\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f ', dtype=np.uint8))
+# The non-ASCII characters str.split() also breaks on, as integers of their UTF-8 bytes
+UNICODE_WHITESPACE = np.array([int.from_bytes(char.encode('utf-8'), 'big') for char in
+                               '\x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005'
+                               '\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'])
+# A literal pattern lets the regex engine use its fast substring search
+DOCSTART = re.compile(rb'-DOCSTART-')
+
+# Raw CoNLL input: bytes or a memory-mapped file
+Buffer = Union[bytes, mmap.mmap]
+
+class Corpus(NamedTuple):
+    """Sentences stored as flat token columns; sentence i spans tokens offsets[i]:offsets[i + 1]."""
+    words: List[str]
+    tag_ids: np.ndarray
+    offsets: np.ndarray
+
+    @property
+    def num_sentences(self) -> int:
+        return self.offsets.size - 1
+
+    def select(self, selected: np.ndarray) -> 'Corpus':
+        """Return the sentences set in the selection mask as a new corpus."""
+        lengths = np.diff(self.offsets)
+        token_mask = np.repeat(selected, lengths)
+        offsets = np.concatenate(([0], np.cumsum(lengths[selected])))
+        return Corpus(list(compress(self.words, token_mask)), self.tag_ids[token_mask], offsets)
+
+def has_unicode_whitespace(buf: np.ndarray) -> bool:
+    """Check whether UTF-8 bytes contain any of the non-ASCII whitespace characters."""
+    # All of them start with 0xC2 or 0xE1-0xE3, so only the two or three bytes from those leads matter
+    leads = np.flatnonzero((buf == 0xc2) | ((buf >= 0xe1) & (buf <= 0xe3)))
+    last = buf.size - 1
+    pairs = buf[leads].astype(np.int64) << 8 | buf[np.minimum(leads + 1, last)]
+    triples = pairs << 8 | buf[np.minimum(leads + 2, last)]
+    return bool(np.isin(pairs, UNICODE_WHITESPACE).any() or np.isin(triples, UNICODE_WHITESPACE).any())
+
+# _screen and the kernels calling it are compiled eagerly for one signature each: a process
+# that loads a second cached overload of a kernel built on the parallel _screen crashes, so
+# other argument types must fail to dispatch instead
+SCREEN_SIGNATURE = ('(int64[::1], int64[::1], int64[::1], int64[::1], int64[::1], boolean, '
+                    'boolean[::1], int64[::1], int64[::1], int64[::1])')
+REFINE_SIGNATURE = '(int32[:, ::1], int32[::1], boolean[::1], int64)'
+
+@njit(cache=True)
+def _sparse_rows(S):
+    """Compress the tag-count matrix to CSR form: each sentence's nonzero tag columns and counts."""
+    n, T = S.shape
+    indptr = np.zeros(n + 1, np.int64)
+    for idx in range(n):
+        indptr[idx + 1] = indptr[idx] + np.count_nonzero(S[idx])
+    tags = np.empty(indptr[n], np.int64)
+    counts = np.empty(indptr[n], np.int64)
+    for idx in range(n):
+        k = indptr[idx]
+        for tag in range(T):
+            if S[idx, tag] != 0:
+                tags[k] = tag
+                counts[k] = S[idx, tag]
+                k += 1
+    return indptr, tags, counts
+
+@njit(cache=True)
+def _can_remove(tags, counts, under, slack):
+    """Check whether removing a sentence keeps every tag it carries near its target."""
+    for k in range(tags.size):
+        tag = tags[k]
+        if under[tag]:
+            # Don't remove if we're already under target
+            return False
+        if slack[tag] < counts[k]:
+            # Don't remove if it would put us too far under target
+            return False
+    return True
+
+@njit(cache=True)
+def _can_add(tags, counts, headroom):
+    """Check whether adding a sentence keeps every tag it carries below the overshoot limit."""
+    for k in range(tags.size):
+        if counts[k] > headroom[tags[k]]:
+            return False
+    return True
+
+@njit(cache=True)
+def _move(tags, counts, sign, current, target, under, slack, headroom, diffs):
+    """Add (sign=1) or remove (sign=-1) a sentence's counts, refresh the per-tag state it touches and return the score change."""
+    score_change = 0
+    for k in range(tags.size):
+        tag = tags[k]
+        count = sign * counts[k]
+        current[tag] += count
+        slack[tag] += count
+        headroom[tag] -= count
+        under[tag] = current[tag] < target[tag]
+        diff = abs(current[tag] - target[tag])
+        score_change += diffs[tag] - diff
+        diffs[tag] = diff
+    return score_change
+
+@njit(cache=True)
+def _collect(selected, value, out):
+    """Write the indices whose mask entry equals value into out and return how many there are."""
+    size = 0
+    for idx in range(selected.size):
+        if selected[idx] == value:
+            out[size] = idx
+            size += 1
+    return size
+
+@njit(SCREEN_SIGNATURE, parallel=True, cache=True)
+def _screen(indptr, tags, counts, candidates, weights, removing, under, slack, headroom, gains):
+    """Score every candidate into gains by its weighted tag count in parallel, zeroing those
+    that fail the removal (or addition) check against the state at the start of the pass."""
+    for i in prange(candidates.size):
+        idx = candidates[i]
+        start, end = indptr[idx], indptr[idx + 1]
+        gain = 0
+        for k in range(start, end):
+            gain += counts[k] * weights[tags[k]]
+        if gain > 0:
+            if removing:
+                admissible = _can_remove(tags[start:end], counts[start:end], under, slack)
+            else:
+                admissible = _can_add(tags[start:end], counts[start:end], headroom)
+            if not admissible:
+                gain = 0
+        gains[i] = gain
+
+@njit(SCREEN_SIGNATURE, cache=True)
+def _by_gain(indptr, tags, counts, candidates, weights, removing, under, slack, headroom, gains):
+    """Keep the admissible candidates with a positive weighted tag count, ordered by descending count and then index."""
+    _screen(indptr, tags, counts, candidates, weights, removing, under, slack, headroom, gains)
+    order = np.argsort(-gains, kind='mergesort')
+    return candidates[order[:np.count_nonzero(gains)]]
+
+@njit(REFINE_SIGNATURE, cache=True)
+def _refine(S, target, selected, max_iter):
+    """Iteratively remove and add sentences, updating the selected mask in place.
+    
+    Returns the best selection mask, its score and the number of iterations run.
+    The sentences available for adding are simply the unset entries of the mask.
+    """
+    n, T = S.shape
+    current = np.zeros(T, np.int64)
+    for idx in range(n):
+        if selected[idx]:
+            current += S[idx]
+    
+    # Each sentence's nonzero tags are extracted once; every check below only touches those
+    indptr, tags, counts = _sparse_rows(S)
+    
+    # Per-tag state kept in sync by _move: removals may undershoot to 80% of the
+    # target (slack), additions may overshoot to 110% (headroom)
+    lower = np.ceil(target * 0.8).astype(np.int64)
+    upper = np.floor(target * 1.1).astype(np.int64)
+    under = current < target
+    slack = current - lower
+    headroom = upper - current
+    diffs = np.abs(current - target)
+    score = -diffs.sum()
+    
+    best = np.zeros(n, np.bool_)
+    best_score = np.iinfo(np.int64).min
+    
+    # Work buffers reused by every pass instead of fresh candidate snapshots
+    pool = np.empty(n, np.int64)
+    gains = np.empty(n, np.int64)
+    
+    iterations = 0
+    for iteration in range(max_iter):
+        iterations += 1
+        
+        # Try removing sentences that contribute to over-represented tags,
+        # largest contribution to the surplus first. Sentences carrying no
+        # surplus tag cannot improve the score and are skipped; the surplus
+        # and slack only shrink during the pass, so sentences screened out
+        # at its start stay out. The survivors are re-checked in order against
+        # the live counts; the mask itself is only read at the start of a pass,
+        # so accepted sentences are compacted to the front of the candidate
+        # array and flipped in one bulk update afterwards.
+        surplus = np.maximum(current - target, 0)
+        size = _collect(selected, True, pool)
+        candidates = _by_gain(indptr, tags, counts, pool[:size], surplus, True, under, slack, headroom, gains[:size])
+        accepted = 0
+        for idx in candidates:
+            if not (current > target).any():
+                break
+            start, end = indptr[idx], indptr[idx + 1]
+            if _can_remove(tags[start:end], counts[start:end], under, slack):
+                score += _move(tags[start:end], counts[start:end], -1, current, target, under, slack, headroom, diffs)
+                candidates[accepted] = idx
+                accepted += 1
+        selected[candidates[:accepted]] = False
+        improved = accepted > 0
+        
+        # Try adding sentences that help under-represented tags,
+        # largest contribution to the deficit first, skipping sentences
+        # that carry no tag in deficit
+        deficit = np.maximum(target - current, 0)
+        size = _collect(selected, False, pool)
+        candidates = _by_gain(indptr, tags, counts, pool[:size], deficit, False, under, slack, headroom, gains[:size])
+        accepted = 0
+        for idx in candidates:
+            if not under.any():
+                break
+            start, end = indptr[idx], indptr[idx + 1]
+            if _can_add(tags[start:end], counts[start:end], headroom):
+                score += _move(tags[start:end], counts[start:end], 1, current, target, under, slack, headroom, diffs)
+                candidates[accepted] = idx
+                accepted += 1
+        selected[candidates[:accepted]] = True
+        improved = improved or accepted > 0
+        
+        # The score is kept up to date by _move
+        if score > best_score:
+            best_score = score
+            best[:] = selected
+        
+        if not improved:
+            break
+    
+    return best, best_score, iterations
+
+def check_target_frequencies(target_frequencies: Dict[str, int]):
+    """Raise ValueError unless the target frequencies map tags to non-negative integer counts."""
+    if not isinstance(target_frequencies, dict):
+        raise ValueError('Target frequencies must be an object mapping tags to counts')
+    for tag, target in target_frequencies.items():
+        # bool is an int subclass but no count, and counts are kept as int32
+        is_integer = isinstance(target, (int, np.integer)) and not isinstance(target, bool)
+        if not is_integer or not 0 <= target <= np.iinfo(np.int32).max:
+            raise ValueError(f"Target frequency for {tag!r} must be a non-negative integer, got {target!r}")
 
 class NERBalancer:
     def __init__(self, target_frequencies: Dict[str, int], max_iterations: int = 50):
+        check_target_frequencies(target_frequencies)
         self.target_frequencies = target_frequencies
         self.max_iterations = max_iterations
+        # 'O' marks tokens outside any entity and is never balanced, whatever its target
+        self.tag_index = {tag: i for i, tag in enumerate(tag for tag in target_frequencies if tag != 'O')}
+        self.target = np.array([target_frequencies[tag] for tag in self.tag_index], dtype=np.int32)
+        # Tags are interned to small integer ids; 'O' is always id 0 and target tags come next
+        self.id2tag = ['O']
+        self.tag2id = {'O': 0}
+        self.target_ids = np.array([self.intern_tag(tag) for tag in self.tag_index], dtype=np.intp)
+
+    def intern_tag(self, tag: str) -> int:
+        """Return the integer id of a tag, assigning the next free id on first sight."""
+        tag_id = self.tag2id.get(tag)
+        if tag_id is None:
+            tag_id = self.tag2id[tag] = len(self.id2tag)
+            self.id2tag.append(tag)
+        return tag_id
         
-    def read_conll(self, filename: str) -> List[List[Tuple[str, str]]]:
-        """Read CoNLL file and return list of sentences with (word, tag) pairs."""
-        sentences = []
-        current_sentence = []
+    def read_conll(self, filename: str) -> Corpus:
+        """Read CoNLL file and return its sentences as a corpus of words and tag ids."""
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be memory-mapped
+                return self.parse_conll(b'')
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                try:
+                    return self.parse_conll(data)
+                except Exception as error:
+                    # Arrays over the map are still referenced from the traceback's frames and
+                    # would make closing it raise BufferError, hiding the original error
+                    traceback.clear_frames(error.__traceback__)
+                    raise
+
+    def parse_conll(self, data: Buffer) -> Corpus:
+        """Parse raw CoNLL bytes (or a memory-mapped file) into a corpus of words and tag ids.
         
-        with open(filename, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith('-DOCSTART-') or not line:
-                    if current_sentence:
-                        sentences.append(current_sentence)
-                        current_sentence = []
-                    continue
-                    
-                parts = line.split()
-                word = parts[0]
-                tag = parts[-1]
-                current_sentence.append((word, tag))
-                
-            if current_sentence:
-                sentences.append(current_sentence)
-                
-        return sentences
-
-    def get_sentence_tag_counts(self, sentence: List[Tuple[str, str]]) -> Dict[str, int]:
-        """Count occurrences of each tag in a sentence."""
-        counts = defaultdict(int)
-        for _, tag in sentence:
-            if tag != 'O':
-                counts[tag] += 1
-        return counts
-
-    def get_current_counts(self, sentences: List[List[Tuple[str, str]]], selected: Set[int], 
-                          sentence_tag_counts: List[Dict[str, int]]) -> Dict[str, int]:
-        """Get current tag counts from selected sentences."""
-        counts = defaultdict(int)
-        for idx in selected:
-            for tag, count in sentence_tag_counts[idx].items():
-                counts[tag] += count
-        return counts
-
-    def calculate_frequency_score(self, current_counts: Dict[str, int]) -> float:
-        """Calculate how far current frequencies are from targets."""
-        score = 0
-        for tag, target in self.target_frequencies.items():
-            current = current_counts.get(tag, 0)
-            score -= abs(current - target)
-        return score
-
-    def should_remove_sentence(self, idx: int, sentence_counts: Dict[str, int], 
-                             current_counts: Dict[str, int]) -> bool:
-        """Determine if removing a sentence would improve overall balance."""
-        for tag, count in sentence_counts.items():
-            if tag in self.target_frequencies:
-                current = current_counts[tag]
-                target = self.target_frequencies[tag]
-                if current < target:
-                    # Don't remove if we're already under target
-                    return False
-                if current - count < target * 0.8:  # Allow some undershoot
-                    # Don't remove if it would put us too far under target
-                    return False
-        return True
-
-    def balance_dataset(self, sentences: List[List[Tuple[str, str]]]) -> List[List[Tuple[str, str]]]:
-        """Balance the dataset through iterative refinement."""
-        sentence_tag_counts = [self.get_sentence_tag_counts(sent) for sent in sentences]
-        best_selected = set()
-        best_score = float('-inf')
+        Lines are split on \n, \r\n and a lone \r, and fields on whitespace as str.split()
+        sees it, matching a file read in text mode.
+        """
+        if has_unicode_whitespace(np.frombuffer(data, dtype=np.uint8)):
+            # Fields may be separated by characters such as U+00A0 that no byte scan can see
+            words, tags, offsets = self.split_lines(str(data, 'utf-8'))
+        else:
+            words, tags, offsets = self.scan_fields(data)
         
-        # Initial selection
-        selected = set(range(len(sentences)))
-        current_counts = self.get_current_counts(sentences, selected, sentence_tag_counts)
+        for tag in set(tags) - self.tag2id.keys():
+            self.intern_tag(tag)
+        tag_ids = np.fromiter(map(self.tag2id.__getitem__, tags), count=len(tags),
+                              dtype=np.min_scalar_type(len(self.id2tag) - 1))
         
-        for iteration in range(self.max_iterations):
-            improved = False
-            
-            # Try removing sentences that contribute to over-represented tags
-            for idx in list(selected):
-                sentence_counts = sentence_tag_counts[idx]
-                if self.should_remove_sentence(idx, sentence_counts, current_counts):
-                    selected.remove(idx)
-                    for tag, count in sentence_counts.items():
-                        current_counts[tag] -= count
-                    improved = True
-            
-            # Try adding sentences that help under-represented tags
-            available = set(range(len(sentences))) - selected
-            for idx in list(available):
-                sentence_counts = sentence_tag_counts[idx]
-                can_add = True
-                for tag, count in sentence_counts.items():
-                    if tag in self.target_frequencies:
-                        if current_counts[tag] + count > self.target_frequencies[tag] * 1.1:  # Allow 10% overshoot
-                            can_add = False
-                            break
-                
-                if can_add:
-                    selected.add(idx)
-                    for tag, count in sentence_counts.items():
-                        current_counts[tag] += count
-                    improved = True
-            
-            # Calculate score for this iteration
-            score = self.calculate_frequency_score(current_counts)
-            if score > best_score:
-                best_score = score
-                best_selected = selected.copy()
-            
-            if not improved:
-                break
+        return Corpus(words, tag_ids, offsets)
+
+    def scan_fields(self, data: Buffer) -> Tuple[List[str], List[str], np.ndarray]:
+        """Extract words, tags and sentence offsets from CoNLL bytes without per-line Python work.
+        
+        Lines and fields are located with vectorized byte scans, -DOCSTART- markers with one
+        compiled regex pass, and the tokens are produced by a single split() of the decoded data.
+        """
+        buf = np.frombuffer(data, dtype=np.uint8)
+        # A carriage return ends a line unless a newline follows it
+        breaks = buf == ord('\n')
+        lone_cr = buf == ord('\r')
+        lone_cr[:-1] &= ~breaks[1:]
+        breaks |= lone_cr
+        line_ends = np.flatnonzero(breaks)
+        if buf.size == 0 or not breaks[-1]:
+            line_ends = np.append(line_ends, buf.size)
+        
+        # A field starts at a non-whitespace byte that follows whitespace or the start of the data
+        is_space = IS_WHITESPACE[buf]
+        field_start = ~is_space
+        field_start[1:] &= is_space[:-1]
+        field_positions = np.flatnonzero(field_start)
+        fields_per_line = np.diff(np.searchsorted(field_positions, line_ends), prepend=0)
+        
+        # Index of the first and last token of every non-blank line within data.split()
+        nonblank = fields_per_line > 0
+        first_token = (np.cumsum(fields_per_line) - fields_per_line)[nonblank]
+        last_token = first_token + fields_per_line[nonblank] - 1
+        
+        # Blank and -DOCSTART- lines both end a sentence; a -DOCSTART- match only
+        # counts when it begins the first field of its line
+        matches = np.fromiter((match.start() for match in DOCSTART.finditer(data)), dtype=np.int64)
+        match_lines = np.searchsorted(line_ends, matches)
+        line_heads = np.full(line_ends.size, -1)
+        line_heads[nonblank] = field_positions[first_token]
+        docstart_lines = np.zeros(line_ends.size, dtype=bool)
+        docstart_lines[match_lines[line_heads[match_lines] == matches]] = True
+        docstart = docstart_lines[nonblank]
+        content = nonblank & ~docstart_lines
+        sentence_start = content & ~np.concatenate(([False], content[:-1]))
+        offsets = np.append(np.flatnonzero(sentence_start[content]), content.sum())
+        
+        tokens = str(data, 'utf-8').split()
+        words = [tokens[i] for i in first_token[~docstart].tolist()]
+        tags = [tokens[i] for i in last_token[~docstart].tolist()]
+        return words, tags, offsets
+
+    def split_lines(self, text: str) -> Tuple[List[str], List[str], np.ndarray]:
+        """Extract words, tags and sentence offsets from decoded CoNLL text one line at a time."""
+        words, tags, offsets = [], [], [0]
+        for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+            line = line.strip()
+            if line.startswith('-DOCSTART-') or not line:
+                if len(words) > offsets[-1]:
+                    offsets.append(len(words))
+                continue
             
-            # Print progress every 10 iterations
-            if iteration % 10 == 0:
-                print(f"Iteration {iteration}, current score: {score}")
-                self.print_current_stats(current_counts)
+            parts = line.split()
+            words.append(parts[0])
+            tags.append(parts[-1])
+        
+        if len(words) > offsets[-1]:
+            offsets.append(len(words))
+        return words, tags, np.array(offsets)
+
+    def get_sentence_tag_counts(self, corpus: Corpus) -> np.ndarray:
+        """Count occurrences of each target tag per sentence as a (sentences, target tags) matrix."""
+        # Target tags map to their columns and every other tag to one extra column that is dropped
+        num_targets = self.target_ids.size
+        column = np.full(len(self.id2tag), num_targets)
+        column[self.target_ids] = np.arange(num_targets)
+        
+        # One histogram over (sentence, column) pairs flattened to a single index
+        width = num_targets + 1
+        sentence_of_token = np.repeat(np.arange(corpus.num_sentences), np.diff(corpus.offsets))
+        flat = np.bincount(sentence_of_token * width + column[corpus.tag_ids], minlength=corpus.num_sentences * width)
+        return flat.reshape(corpus.num_sentences, width)[:, :num_targets].astype(np.int32)
+
+    def counts_by_tag(self, counts: np.ndarray) -> Dict[str, int]:
+        """Map a vector of counts indexed by tag id to the non-'O' tags that occur."""
+        return {self.id2tag[tag_id]: int(counts[tag_id]) for tag_id in np.flatnonzero(counts) if tag_id != 0}
+
+    def get_current_counts(self, selected: np.ndarray, sentence_tag_counts: np.ndarray) -> np.ndarray:
+        """Get current target tag counts from the sentences set in the selection mask."""
+        return sentence_tag_counts[selected].sum(axis=0, dtype=np.int32)
+
+    def balance_dataset(self, corpus: Corpus) -> Tuple[Corpus, np.ndarray]:
+        """Balance the dataset through iterative refinement.
+        
+        Returns the selected sentences and their tag counts indexed by tag id.
+        """
+        sentence_tag_counts = self.get_sentence_tag_counts(corpus)
+        
+        # Initial selection
+        selected = np.ones(corpus.num_sentences, dtype=bool)
+        best_selected, best_score, iterations = _refine(sentence_tag_counts, self.target, selected, self.max_iterations)
+        
+        print(f"Finished after {iterations} iterations, best score: {best_score}")
+        self.print_current_stats(self.get_current_counts(best_selected, sentence_tag_counts))
         
         # Return best result found
-        return [sentences[idx] for idx in sorted(best_selected)]
+        balanced = corpus.select(best_selected)
+        return balanced, np.bincount(balanced.tag_ids, minlength=len(self.id2tag))
 
-    def write_conll(self, sentences: List[List[Tuple[str, str]]], output_filename: str):
+    def write_conll(self, corpus: Corpus, output_filename: str):
         """Write sentences back to CoNLL format."""
-        with open(output_filename, 'w', encoding='utf-8') as f:
-            f.write('-DOCSTART- -X- O O\n\n')
-            for sentence in sentences:
-                for word, tag in sentence:
-                    f.write(f"{word} -X- _ {tag}\n")
-                f.write("\n")
-
-    def print_current_stats(self, current_counts: Dict[str, int]):
+        with open(output_filename, 'wb') as f:
+            self.write_conll_stream(corpus, f)
+
+    def write_conll_stream(self, corpus: Corpus, fileobj: BinaryIO):
+        """Write sentences in CoNLL format to a binary file object, such as an in-memory buffer."""
+        # Format every token line in one pass over the flat columns and hand the file a single write
+        suffixes = [f" -X- _ {tag}\n" for tag in self.id2tag]
+        lines = list(map(str.__add__, corpus.words, map(suffixes.__getitem__, corpus.tag_ids.tolist())))
+        
+        # Every sentence, including the last, is followed by a blank line
+        for end in corpus.offsets[1:].tolist():
+            lines[end - 1] += '\n'
+        fileobj.write(('-DOCSTART- -X- O O\n\n' + ''.join(lines)).encode('utf-8'))
+
+    def print_current_stats(self, current_counts: np.ndarray):
         """Print current tag frequencies and differences from targets."""
         print("\nCurrent tag frequencies:")
-        for tag, count in sorted(current_counts.items()):
-            target = self.target_frequencies.get(tag, 0)
+        for tag, col in sorted(self.tag_index.items()):
+            count = int(current_counts[col])
+            target = self.target_frequencies[tag]
             diff = count - target if target > 0 else count
             print(f"{tag}: {count} (target: {target}, diff: {diff})")
 
     def process_file(self, input_filename: str, output_filename: str):
         """Process the entire file."""
-        sentences = self.read_conll(input_filename)
-        balanced_sentences = self.balance_dataset(sentences)
-        self.write_conll(balanced_sentences, output_filename)
-        
-        # Print final statistics
-        tag_counts = defaultdict(int)
-        for sentence in balanced_sentences:
-            for _, tag in sentence:
-                if tag != 'O':
-                    tag_counts[tag] += 1
-                    
-        print("\nFinal tag frequencies:")
-        for tag, count in sorted(tag_counts.items()):
-            target = self.target_frequencies.get(tag, 0)
-            diff = count - target if target > 0 else count
-            print(f"{tag}: {count} (target: {target}, diff: {diff})")
+        corpus = self.read_conll(input_filename)
+        balanced, _ = self.balance_dataset(corpus)
+        self.write_conll(balanced, output_filename)
 
 app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'outputs'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['JOB_WORKERS'] = min(4, os.cpu_count() or 1)  # balancing jobs run at the same time
+app.config['JOB_TTL'] = 60 * 60  # seconds a finished job's result waits to be fetched
 
-# Ensure upload and output directories exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Ensure output directory exists
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
-def get_tag_frequencies(sentences: List[List[Tuple[str, str]]], target_frequencies: Dict[str, int]) -> Dict[str, Dict]:
+class Job(NamedTuple):
+    future: Future
+    output_filename: str
+    submitted: float
+
+# Balancing runs in worker processes so requests never block on it; jobs are
+# tracked by id until their result has been fetched from /jobs/<id> or expires. Workers are
+# spawned rather than forked: importing app already started Numba's threads, which a fork does not copy
+EXECUTOR: Optional[ProcessPoolExecutor] = None
+EXECUTOR_LOCK = threading.Lock()
+JOBS: Dict[str, Job] = {}
+
+def init_worker(num_threads: int):
+    """Size a worker's Numba thread pool so that all workers together use each CPU once."""
+    set_num_threads(num_threads)
+
+def submit_job(*args) -> Future:
+    """Run run_balance_job(*args) in the worker pool, starting a new pool if there is none or it broke."""
+    global EXECUTOR
+    with EXECUTOR_LOCK:
+        if EXECUTOR is not None:
+            try:
+                return EXECUTOR.submit(run_balance_job, *args)
+            except BrokenProcessPool:
+                # A worker died and took the pool down with it; its jobs fail, later ones get a new pool
+                EXECUTOR.shutdown(wait=False)
+        workers = app.config['JOB_WORKERS']
+        EXECUTOR = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=init_worker, initargs=(max(1, (os.cpu_count() or 1) // workers),))
+        return EXECUTOR.submit(run_balance_job, *args)
+
+def expire_jobs():
+    """Forget finished jobs whose results were not fetched within JOB_TTL seconds."""
+    cutoff = time.monotonic() - app.config['JOB_TTL']
+    for job_id, job in list(JOBS.items()):
+        if job.submitted < cutoff and job.future.done():
+            JOBS.pop(job_id, None)
+
+def get_tag_frequencies(tag_counts: Dict[str, int], target_frequencies: Dict[str, int]) -> Dict[str, Dict]:
     """Calculate current tag frequencies and differences from targets."""
-    tag_counts = defaultdict(int)
-    for sentence in sentences:
-        for _, tag in sentence:
-            if tag != 'O':
-                tag_counts[tag] += 1
-    
     # Format the results
     frequencies = {}
     for tag in sorted(tag_counts.keys()):
@@ -197,6 +503,44 @@ def get_tag_frequencies(sentences: List[List[Tuple[str, str]]], target_frequenci
     
     return frequencies
 
+def run_balance_job(data: bytes, target_frequencies: Dict[str, int], output_path: str,
+                    download: bool, text_report: bool) -> Tuple[str, object]:
+    """Balance one uploaded file in a worker process.
+    
+    Returns the kind of result ('file', 'text' or 'json') and its payload for /jobs/<id>.
+    """
+    balancer = NERBalancer(target_frequencies)
+    corpus = balancer.parse_conll(data)
+    balanced, tag_counts = balancer.balance_dataset(corpus)
+    
+    # Return the balanced file itself when requested, built entirely in memory
+    if download:
+        buffer = io.BytesIO()
+        balancer.write_conll_stream(balanced, buffer)
+        return 'file', buffer.getvalue()
+    
+    balancer.write_conll(balanced, output_path)
+    
+    # Get frequency statistics
+    frequencies = get_tag_frequencies(balancer.counts_by_tag(tag_counts), target_frequencies)
+    
+    # Plain-text frequency report, one line per tag, when asked for with ?format=text
+    if text_report:
+        return 'text', '\n'.join(
+            f"{tag}: {stats['count']} (target: {stats['target']}, diff: {stats['diff']})"
+            for tag, stats in frequencies.items()
+        )
+    
+    return 'json', {
+        'message': 'File processed successfully',
+        'output_file': output_path,
+        'tag_frequencies': frequencies,
+        'summary': {
+            'total_sentences': balanced.num_sentences,
+            'total_tags': sum(stats['count'] for stats in frequencies.values())
+        }
+    }
+
 @app.route('/balance', methods=['POST'])
 def balance_tags():
     try:
@@ -215,8 +559,11 @@ def balance_tags():
         
         try:
             target_frequencies = json.loads(target_frequencies)
+            check_target_frequencies(target_frequencies)
         except json.JSONDecodeError:
             return jsonify({'error': 'Invalid target frequencies format'}), 400
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Get output filename if provided
         output_filename = request.form.get('output_filename')
@@ -225,45 +572,52 @@ def balance_tags():
         else:
             output_filename = secure_filename(output_filename)
         
-        # Save uploaded file
-        input_filename = secure_filename(file.filename)
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
-        output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-        file.save(input_path)
-        
-        # Process file
-        balancer = NERBalancer(target_frequencies)
-        sentences = balancer.read_conll(input_path)
-        balanced_sentences = balancer.balance_dataset(sentences)
-        balancer.write_conll(balanced_sentences, output_path)
-        
-        # Get frequency statistics
-        frequencies = get_tag_frequencies(balanced_sentences, target_frequencies)
-        
-        # Format the frequencies for display
-        formatted_frequencies = []
-        for tag, stats in frequencies.items():
-            formatted_frequencies.append(
-                f"{tag}: {stats['count']} (target: {stats['target']}, diff: {stats['diff']})"
-            )
-        
-        # Cleanup input file
-        os.remove(input_path)
+        # Hand the upload to a worker process and let the client poll for the result
+        expire_jobs()
+        job_id = uuid.uuid4().hex
+        JOBS[job_id] = Job(submit_job(
+            file.stream.read(),
+            target_frequencies,
+            os.path.join(app.config['OUTPUT_FOLDER'], output_filename),
+            request.form.get('download', '').lower() in ('1', 'true', 'yes'),
+            request.args.get('format') == 'text'
+        ), output_filename, time.monotonic())
         
         return jsonify({
-            'message': 'File processed successfully',
-            'output_file': output_path,
-            'tag_frequencies': frequencies,
-            'formatted_frequencies': formatted_frequencies,
-            'summary': {
-                'total_sentences': len(balanced_sentences),
-                'total_tags': sum(stats['count'] for stats in frequencies.values())
-            }
-        })
+            'message': 'Job accepted',
+            'job_id': job_id,
+            'status_url': url_for('job_status', job_id=job_id)
+        }), 202
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    expire_jobs()
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job id'}), 404
+    
+    future, output_filename, _ = job
+    if not future.done():
+        return jsonify({'job_id': job_id, 'status': 'running' if future.running() else 'pending'}), 202
+    
+    # Finished jobs are handed out once and then forgotten; concurrent polls may both get the result
+    JOBS.pop(job_id, None)
+    try:
+        kind, payload = future.result()
+    except BrokenProcessPool:
+        return jsonify({'error': 'The worker process running this job died, please submit it again'}), 500
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    if kind == 'file':
+        return send_file(io.BytesIO(payload), mimetype='text/plain', as_attachment=True, download_name=output_filename)
+    if kind == 'text':
+        return Response(payload, mimetype='text/plain')
+    return jsonify(payload)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy'})
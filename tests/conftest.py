@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# app.py lives at the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def pytest_configure(config):
+    # Importing app creates its outputs folder in the working directory; keep it out of the tree
+    os.chdir(tempfile.mkdtemp())
@@ -0,0 +1,105 @@
+import io
+import json
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import app as api
+
+TARGETS = {'B-PER': 1, 'B-LOC': 1}
+CONLL = b'Juan _ B-PER\nen _ O\nLima _ B-LOC\n\nAna _ B-PER\nvino _ O\n'
+
+
+@pytest.fixture(scope='module', autouse=True)
+def worker_pool():
+    # One spawned worker is enough for these tests; shut it down with them
+    api.app.config['JOB_WORKERS'] = 1
+    yield
+    if api.EXECUTOR is not None:
+        api.EXECUTOR.shutdown()
+
+
+@pytest.fixture
+def client():
+    return api.app.test_client()
+
+
+def post_balance(client, target_frequencies=TARGETS, query='', **form):
+    data = {'file': (io.BytesIO(CONLL), 'in.conll'), 'target_frequencies': json.dumps(target_frequencies), **form}
+    return client.post('/balance' + query, data=data)
+
+
+def wait_for(client, status_url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while (response := client.get(status_url)).status_code == 202:
+        assert time.monotonic() < deadline, 'job did not finish in time'
+        time.sleep(0.1)
+    return response
+
+
+def test_balance_job_result_is_fetched_once(client):
+    response = post_balance(client)
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['status_url'] == f"/jobs/{job['job_id']}"
+
+    result = wait_for(client, job['status_url'])
+    assert result.status_code == 200
+    assert result.get_json()['summary'] == {'total_sentences': 1, 'total_tags': 2}
+    assert client.get(job['status_url']).status_code == 404
+
+
+def test_balance_job_returns_the_file_with_download(client):
+    result = wait_for(client, post_balance(client, download='true').get_json()['status_url'])
+    assert result.status_code == 200
+    assert 'attachment; filename=balanced_in.conll' in result.headers['Content-Disposition']
+    assert result.data == b'-DOCSTART- -X- O O\n\nJuan -X- _ B-PER\nen -X- _ O\nLima -X- _ B-LOC\n\n'
+
+
+def test_balance_job_returns_a_text_report(client):
+    result = wait_for(client, post_balance(client, query='?format=text').get_json()['status_url'])
+    assert result.mimetype == 'text/plain'
+    assert result.get_data(as_text=True) == 'B-LOC: 1 (target: 1, diff: 0)\nB-PER: 1 (target: 1, diff: 0)'
+
+
+def test_unfetched_job_expires_after_job_ttl(client, monkeypatch):
+    job = post_balance(client).get_json()
+    api.JOBS[job['job_id']].future.result(timeout=120)
+    monkeypatch.setitem(api.app.config, 'JOB_TTL', 0)
+    assert client.get(job['status_url']).status_code == 404
+    assert job['job_id'] not in api.JOBS
+
+
+def test_job_reports_a_dead_worker(client):
+    future = Future()
+    future.set_exception(BrokenProcessPool('A process in the process pool was terminated abruptly'))
+    api.JOBS['dead'] = api.Job(future, 'balanced_in.conll', time.monotonic())
+    response = client.get('/jobs/dead')
+    assert response.status_code == 500
+    assert 'submit it again' in response.get_json()['error']
+
+
+def test_submit_job_replaces_a_broken_pool(client):
+    class BrokenExecutor:
+        def submit(self, *args):
+            raise BrokenProcessPool('A child process terminated abruptly, the process pool is not usable anymore')
+
+        def shutdown(self, wait=True):
+            self.shut_down = True
+
+    if api.EXECUTOR is not None:
+        api.EXECUTOR.shutdown()
+    api.EXECUTOR = broken = BrokenExecutor()
+    result = wait_for(client, post_balance(client).get_json()['status_url'])
+    assert result.status_code == 200
+    assert broken.shut_down
+    assert api.EXECUTOR is not broken
+
+
+@pytest.mark.parametrize('target_frequencies', [[1], {'B-PER': 1.5}, {'B-PER': -3}])
+def test_balance_rejects_invalid_target_frequencies(client, target_frequencies):
+    response = post_balance(client, target_frequencies)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
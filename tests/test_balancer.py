@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app import NERBalancer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_sentence_is_re_added_while_another_tag_stays_over_its_limit(tmp_path):
+    # B-LOC stays at twice its target because neither sentence carrying it can be removed; that
+    # must not keep the B-PER sentence dropped by the removal pass from being added back
+    source, output = tmp_path / 'in.conll', tmp_path / 'out.conll'
+    source.write_text('Ayer _ B-ORG\nJuan _ B-PER\nAna _ B-PER\nLima _ B-LOC\n\n'
+                      'Luis _ B-PER\n\n'
+                      'Quito _ B-LOC\nEva _ B-PER\ny _ O\nLeo _ B-PER\n', encoding='utf-8')
+    NERBalancer({'B-LOC': 1, 'B-PER': 5}).process_file(str(source), str(output))
+    assert 'Luis -X- _ B-PER' in output.read_text(encoding='utf-8')
+
+
+def test_o_target_does_not_constrain_the_selection():
+    balancer = NERBalancer({'B-PER': 1, 'O': 1})
+    balanced, _ = balancer.balance_dataset(balancer.parse_conll(b'Juan _ B-PER\nvino _ O\n\nya _ O\nmismo _ O\n'))
+    assert balanced.words == ['Juan', 'vino', 'ya', 'mismo']
+
+
+@pytest.mark.parametrize('target', [350.5, -1, True, '350', 2 ** 31])
+def test_target_frequencies_must_be_non_negative_integers(target):
+    with pytest.raises(ValueError):
+        NERBalancer({'B-PER': target})
+
+
+def sentences(balancer, corpus):
+    return [[(corpus.words[i], balancer.id2tag[corpus.tag_ids[i]]) for i in range(start, end)]
+            for start, end in zip(corpus.offsets[:-1].tolist(), corpus.offsets[1:].tolist())]
+
+
+def test_parse_conll_splits_lines_like_text_mode():
+    balancer = NERBalancer({'B-PER': 1})
+    corpus = balancer.parse_conll(b'-DOCSTART- -X- O O\r\rJuan _ B-PER\rvino _ O\r\n\r\nya _ O')
+    assert sentences(balancer, corpus) == [[('Juan', 'B-PER'), ('vino', 'O')], [('ya', 'O')]]
+
+
+def test_parse_conll_splits_fields_on_unicode_whitespace():
+    balancer = NERBalancer({'B-PER': 1})
+    data = 'Juan\xa0Pérez _ B-PER\nvino\x1c_ O\n\n\u3000-DOCSTART-\nya _ O\n'.encode('utf-8')
+    corpus = balancer.parse_conll(data)
+    assert sentences(balancer, corpus) == [[('Juan', 'B-PER'), ('vino', 'O')], [('ya', 'O')]]
+
+
+def test_sentence_tag_counts_have_one_column_per_target_tag():
+    balancer = NERBalancer({'B-LOC': 1, 'B-PER': 1})
+    corpus = balancer.parse_conll(b'Juan _ B-PER\nde _ O\nACME _ B-ORG\n\nLima _ B-LOC\ny _ O\nQuito _ B-LOC\n')
+    assert balancer.get_sentence_tag_counts(corpus).tolist() == [[0, 1], [2, 0]]
+
+
+BALANCE_SCRIPT = '''
+import sys
+from app import NERBalancer
+balancer = NERBalancer({'B-PER': 1, 'B-LOC': 1})
+sentences = int(sys.argv[1])
+corpus = balancer.parse_conll(b'Juan _ B-PER\\nen _ O\\nLima _ B-LOC\\n\\n' * sentences)
+balanced, _ = balancer.balance_dataset(corpus)
+assert balanced.num_sentences == 1
+'''
+
+
+def test_balance_dataset_survives_cached_kernels_across_layouts(tmp_path):
+    # Corpora of one and of several sentences once gave count matrices of different layouts, and
+    # a second cached kernel overload crashed on load; each run gets a fresh process so the
+    # kernels are loaded from the shared disk cache
+    env = dict(os.environ, NUMBA_CACHE_DIR=str(tmp_path / 'numba'), PYTHONPATH=ROOT)
+    for sentences in (3, 1, 1, 3):
+        result = subprocess.run([sys.executable, '-c', BALANCE_SCRIPT, str(sentences)],
+                                cwd=tmp_path, env=env, capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+
+
+def test_read_conll_reports_decoding_errors(tmp_path):
+    path = tmp_path / 'latin1.conll'
+    path.write_bytes('café _ O\n'.encode('latin-1'))
+    with pytest.raises(UnicodeDecodeError):
+        NERBalancer({'B-PER': 1}).read_conll(str(path))